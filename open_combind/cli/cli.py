@@ -138,7 +138,9 @@ def ligprep(smiles, root, multiplex, ligand_names, ligand_smiles,
 @click.option('--slurm', is_flag=True)
 @click.option('--now', is_flag=True)
 @click.option('--dock-file')
-def dock_ligands(template, root, ligands, screen, slurm, now, dock_file):
+@click.option('--processes', default=1, help='number of CPUs for each GNINA run, -1 means use all available processes')
+@click.option('--jobs', default=1, help='number of GNINA runs to perform at the same time when using --now')
+def dock_ligands(template, root, ligands, screen, slurm, now, dock_file, processes, jobs):
     """
     Dock "ligands" to "grid".
 
@@ -152,8 +154,12 @@ def dock_ligands(template, root, ligands, screen, slurm, now, dock_file):
     "dock_file" is a format string that will be used with all of the ligands to 
     create a docking file. The default looks like:
      "-l {lig} -o {out} --exhaustiveness {exh} --num_modes 200 > {log} \n"
+
+    "processes" sets the number of CPUs each GNINA run uses and "jobs" the
+    number of GNINA runs performed at the same time when docking with "now".
     """
-    oc.dock_ligands(ligands, template=template, dock_file=dock_file, root=root, screen=screen, slurm=slurm, now=now)
+    oc.dock_ligands(ligands, template=template, dock_file=dock_file, root=root, screen=screen, slurm=slurm, now=now,
+                    processes=processes, jobs=jobs)
 
 ################################################################################
 
@@ -43,7 +43,7 @@ def check_dock_line(infile):
 
     return infile
 
-def dock(template, ligands, root, name, enhanced, infile=None, slurm=False, now=False, processes=1):
+def dock(template, ligands, root, name, enhanced, infile=None, slurm=False, now=False, processes=1, jobs=1):
     """
     Generate GNINA docking file that utilizes the receptor and autobox as defined in `template` to dock against each of the ligands in `ligands` using the format string `infile`
 
@@ -70,6 +70,10 @@ def dock(template, ligands, root, name, enhanced, infile=None, slurm=False, now=
         tarball
     now : bool, default=False
         After generating docking string, run docking immediately
+    processes : int, default=1
+        Number of CPUs for each GNINA run to use when `now` is set
+    jobs : int, default=1
+        Number of GNINA runs to perform at the same time when `now` is set
     """
 
     outfile = "{root}/{inlig}-docked.sdf.gz"
@@ -87,24 +91,29 @@ def dock(template, ligands, root, name, enhanced, infile=None, slurm=False, now=
     if slurm:
         dock_line = dock_line.replace('>', '--cpu 1 >')
 
-    if not os.path.exists(root):
-        os.system('mkdir {}'.format(root))
+    os.makedirs(root, exist_ok=True)
     gnina_in = '{}_docking_file.txt'.format(recname)
-    with open(gnina_in, 'w') as fp:
-        for lig, n in zip(ligands, name):
-            out = outfile.format(inlig=n, root=root)
-            gnina_log = f"{recname}_{n}.log"
+    out_format = outfile.format
+    dock_format = dock_line.format
+    lines = []
+    for lig, n in zip(ligands, name):
+        out = out_format(inlig=n, root=root)
+        gnina_log = f"{recname}_{n}.log"
+
+        # skip ligands that have already been docked
+        if os.path.exists(out):
+            continue
 
-            if os.path.exists(outfile):
-                return
+        if enhanced and docking_failed(gnina_log):
+            continue
 
-            if enhanced and docking_failed(gnina_log):
-                return
+        lines += [dock_format(lig=lig, out=out, exh=exh, log=gnina_log) + '\n']
 
-            fp.write(dock_line.format(lig=lig, out=out, exh=exh, log=gnina_log) + '\n')
+    with open(gnina_in, 'w') as fp:
+        fp.write(''.join(lines))
 
     if now:
-        run_gnina_docking(gnina_in, processes=processes)
+        run_gnina_docking(gnina_in, processes=processes, jobs=jobs)
     elif slurm:
         receptor = dock_template.split('-r')[-1].strip().split(' ')[0]
         abox = dock_template.split('--autobox_ligand')[-1].strip().split(' ')[0]
@@ -113,7 +122,7 @@ def dock(template, ligands, root, name, enhanced, infile=None, slurm=False, now=
 
 def setup_slurm(gnina_in, ligands, receptor, abox):
     """
-    Creates a tarball of the `receptor`, `abox` and all of the `ligands`. Then runs :command:`sed` on `gnina_in` to remove the path to the current working directory.
+    Creates a tarball of the `receptor`, `abox` and all of the `ligands`. Then removes the path to the current working directory from the commands in `gnina_in`.
 
     Parameters
     ----------
@@ -137,20 +146,45 @@ def setup_slurm(gnina_in, ligands, receptor, abox):
 
     tarfiles = (receptor, abox, *ligands, *native_ligs, custom_atom_typing)
     new_tar = gnina_in.replace('.txt', '.tar.gz')
-    tar = tarfile.open(new_tar, "w:gz")
-
-    for fname in tarfiles:
-        tar.add(os.path.relpath(fname))
-    tar.close()
+    # fast compression, most of the tarball is ligand files that are often already gzipped
+    with tarfile.open(new_tar, "w:gz", compresslevel=1) as tar:
+        for fname in tarfiles:
+            tar.add(os.path.relpath(fname))
 
     cwd = os.getcwd() + '/'
-    os.system(f'sed -i s,{cwd},,g {gnina_in}')
+    with open(gnina_in) as fp:
+        gnina_cmds = fp.read()
+    with open(gnina_in, 'w') as fp:
+        fp.write(gnina_cmds.replace(cwd, ''))
 
     os.remove(os.path.abspath(custom_atom_typing))
 
-def run_gnina_docking(gnina_dock_file, processes=1):
+def run_gnina_cmd(gnina_cmd, processes=1, gnina_exec='gnina'):
+    """
+    Run a single line of a GNINA docking commands file, writing the GNINA output to the log file of the line.
+
+    Parameters
+    ----------
+    gnina_cmd : str
+        GNINA docking command of the form ``gnina <GNINA_KWARGS> > {log}``
+    processes : int, default=1
+        Number of CPUs for GNINA to use, if the command does not already specify ``--cpu``
+    gnina_exec : str, default='gnina'
+        GNINA executable to use when the command calls a bare ``gnina``
     """
-    Iterates over the lines in `gnina_dock_file` and runs each line in serial.
+    gnina_run, logfile = gnina_cmd.split('>')
+    if ' --cpu ' not in gnina_run:
+        gnina_run += ' --cpu {}'.format(processes)
+    logfile = logfile.strip()
+    with open(logfile, 'w') as log:
+        run_cmds = gnina_run.strip().split()
+        if run_cmds[0] == 'gnina' and gnina_exec != 'gnina':
+            run_cmds[0] = gnina_exec
+        subprocess.run(run_cmds, check=True, stderr=subprocess.STDOUT, stdout=log)
+
+def run_gnina_docking(gnina_dock_file, processes=1, jobs=1):
+    """
+    Iterates over the lines in `gnina_dock_file` and runs each line, `jobs` lines at a time.
 
     Generates a tqdm progress bar to show what percent of the lines have been run
     
@@ -158,37 +192,35 @@ def run_gnina_docking(gnina_dock_file, processes=1):
     ----------
     gnina_dock_file : str
         Path to GNINA docking commands file
+    processes : int, default=1
+        Number of CPUs for each GNINA run to use, if -1 then use all available cores
+    jobs : int, default=1
+        Number of GNINA runs to perform at the same time, if -1 then use all available cores
     """
+    from functools import partial
+    from multiprocessing import Pool
+    from shutil import which
     from tqdm import tqdm
-    import mmap
 
     def get_num_lines(file_path):
-        fp = open(file_path, "r+")
-        buf = mmap.mmap(fp.fileno(), 0)
-        lines = 0
-        while buf.readline():
-            lines += 1
-        return lines
+        with open(file_path, 'rb') as fp:
+            return sum(buf.count(b'\n') for buf in iter(lambda: fp.read(1 << 20), b''))
 
     print("Running GNINA docking")
-    run_exec = False
+    if processes == -1:
+        processes = os.cpu_count()
+    # fall back to a gnina executable in the working directory
+    gnina_exec = 'gnina'
+    if which(gnina_exec) is None and os.path.exists('./gnina'):
+        gnina_exec = './gnina'
+    run_cmd = partial(run_gnina_cmd, processes=processes, gnina_exec=gnina_exec)
+
+    total = get_num_lines(gnina_dock_file)
     with open(gnina_dock_file) as gnina_cmds:
-        for gnina_cmd in tqdm(gnina_cmds, total=get_num_lines(gnina_dock_file)):
-            gnina_run, logfile = gnina_cmd.split('>')
-            if ' --cpu ' not in gnina_run:
-                gnina_run += ' --cpu {}'.format(processes)
-            logfile = logfile.strip()
-            with open(logfile, 'w') as log:
-                run_cmds = gnina_run.strip().split()
-                if run_exec is True:
-                    run_cmds[0] = "./gnina"
-                try:
-                    subprocess.run(run_cmds, check=True, stderr=subprocess.STDOUT, stdout=log)
-                except FileNotFoundError as fnfe:
-                    if "No such file or directory: 'gnina'" in str(fnfe):
-                        run_cmds[0] = "./gnina"
-                        run_exec = True
-                    else:
-                        raise fnfe
-
-
+        if jobs != 1:
+            with Pool(processes=None if jobs == -1 else jobs) as pool:
+                for _ in tqdm(pool.imap_unordered(run_cmd, gnina_cmds), total=total):
+                    pass
+        else:
+            for gnina_cmd in tqdm(gnina_cmds, total=total):
+                run_cmd(gnina_cmd)
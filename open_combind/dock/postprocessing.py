@@ -5,6 +5,7 @@ import gzip
 import os
 from rdkit.Chem import ForwardSDMolSupplier, SDWriter
 from rdkit.Chem.rdMolAlign import CalcRMS
+from open_combind.utils import gzip_open
 
 def coalesce_poses(docked_files, sort_by='CNNscore', filter_RMSD=None, reverse=True):
     """
@@ -34,7 +35,7 @@ def coalesce_poses(docked_files, sort_by='CNNscore', filter_RMSD=None, reverse=T
         docked_files = [docked_files]
     for dock_file in docked_files:
         if dock_file.endswith('.gz'):
-            openfile = gzip.open
+            openfile = gzip_open
         else:
             openfile = open
         with openfile(dock_file,'rb') as gz:
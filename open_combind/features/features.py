@@ -1,12 +1,12 @@
 import os
-import gzip
+from collections import Counter
 import numpy as np
 import pandas as pd
 from glob import glob
 from rdkit.Chem import AllChem as Chem
 from rdkit.Chem.rdMolTransforms import ComputeCentroid
 from rdkit.Geometry.rdGeometry import Point3D
-from open_combind.utils import basename, mp, mkdir, np_load
+from open_combind.utils import basename, mp, mkdir, np_load, gzip_open
 from scipy.special import logit
 
 IFP = {'rd1':    {'version'           : 'rd1',
@@ -21,6 +21,68 @@ IFP = {'rd1':    {'version'           : 'rd1',
                    'contact_scale_cut' : 1.75,},
       }
 
+# Pairwise features grow quadratically with the number of poses, so they are
+# stored at half precision. Scoring only interpolates the feature densities.
+PAIR_DTYPE = np.float16
+
+# The per-file stages of Features.compute_single_features that run in worker
+# processes are module-level so the Features instance is not pickled per task.
+def compute_rmsd(bundle, native_poses, out):
+    """
+    Compute the root mean square deviation (RMSD) from the poses to their native pose, if available.
+
+    Parameters
+    ----------
+    bundle : :class:`list[Mol]<list>`
+        :class:`~rdkit.Chem.rdchem.Mol` s to process
+    native_poses : :class:`dict[str,Mol]<dict>`
+        Dictionary with keys as ligand names and values as :class:`~rdkit.Chem.rdchem.Mol` s of the native ligand poses
+    out : str
+        Path to `.npy` file to save all of the pose RMSDs
+
+    See Also
+    --------
+    Features.compute_rmsd
+    """
+
+    rmsds = []
+    name = os.path.basename(out).split('-')[0]
+    # print(name)
+    if name in native_poses:
+        native = native_poses[name]
+        for idx, st in enumerate(bundle):
+            rmsd = Chem.CalcRMS(native, st)
+            rmsds += [rmsd]
+    else:
+        # print(name)
+        rmsds = [-1] * len(bundle)
+
+    np.save(out, rmsds, allow_pickle=False)
+
+def compute_ifp(pv, out, ifp_version, max_poses):
+    """
+    Compute the interaction fingerprint (IFP) of the ligand poses in `pv`.
+
+    Parameters
+    ----------
+    pv : str
+        Path to poses
+    out : str
+        Path to `.csv` file to save all of the pose IFPs
+    ifp_version : str
+        Version of the interaction fingerprint to use, a key of ``IFP``
+    max_poses : int
+        Maximum number of poses to fingerprint
+
+    See Also
+    --------
+    Features.compute_ifp
+    """
+
+    from open_combind.features.ifp import ifp
+    settings = IFP[ifp_version]
+    ifp(settings, pv, out, max_poses)
+
 # add an option to change which score you get from gnina
 class Features:
     """
@@ -83,7 +145,14 @@ class Features:
             abox_ligand = template_line.split('--autobox_ligand')[-1].split()[0]
         self.center_ligand = Chem.MolFromMolFile(abox_ligand) if self.check_center_ligs else None
 
+        # file suffixes of the single pose features, which are stored next to the poses
+        self._single_ext = {name: '_{}.npy'.format(name)
+                            for name in ['rmsd', 'gscore', 'gaff', 'vaff', 'name']}
+        self._single_ext['ifp'] = '_ifp_{}.csv'.format(self.ifp_version)
+
         self.raw = {}
+        self._lig_slice = None
+        self._molbundles = {}
 
     def get_molecules_from_files(self, pvs, native=False, center_ligand=None):
         """
@@ -116,7 +185,7 @@ class Features:
             mol_bundle = []
             pv_open = pv
             if pv.endswith('.gz'):
-                pv_open = gzip.open(pv)
+                pv_open = gzip_open(pv)
             mol_suppl = Chem.ForwardSDMolSupplier(pv_open)
             mol_count = 0
             for mol in mol_suppl:
@@ -161,12 +230,8 @@ class Features:
             return '{}/{}'.format(self.root, name)
 
         # single features
-        if name in ['rmsd', 'gscore', 'gaff', 'vaff', 'name','ifp']:
-            if name == 'ifp':
-                ext = '_ifp_{}.csv'.format(self.ifp_version)
-            else:
-                ext = '_{}.npy'.format(name)
-            return pv.replace('.gz', '').replace('.sdf', ext)
+        if name in self._single_ext:
+            return pv.replace('.gz', '').replace('.sdf', self._single_ext[name])
 
         # pair features
         else:
@@ -175,12 +240,39 @@ class Features:
     def load_features(self):
         """
         Load all of the features into self.raw
+
+        The arrays are memory-mapped, so only the parts of the pairwise features
+        that are accessed (e.g. by :meth:`get_view`) are read from disk.
         """
 
         paths = glob(f'{self.root}/*.npy')
         for path in paths:
             name = path.split('/')[-1][:-4]
-            self.raw[name] = np.load(path)
+            self.raw[name] = np.load(path, mmap_mode='r', allow_pickle=False)
+        self._lig_slice = None
+
+    def _index_ligands(self):
+        """
+        Group the poses in ``self.raw`` so each ligand occupies a contiguous block of rows
+
+        If the poses of a ligand are not already contiguous, the per-pose arrays (``*1``) and
+        the square pairwise matrices are stably reordered by ligand name. Sets ``self._lig_slice``
+        to a dictionary from ligand name to the ``(start, stop)`` indices of its poses.
+        """
+        names = self.raw['name1']
+        n = len(names)
+        starts = np.flatnonzero(np.concatenate(([True], names[1:] != names[:-1])))
+        if len(starts) != len(np.unique(names)):
+            order = np.argsort(names, kind='stable')
+            for key, value in self.raw.items():
+                if value.shape == (n,) and key.endswith('1'):
+                    self.raw[key] = value[order]
+                elif value.shape == (n, n):
+                    self.raw[key] = value[np.ix_(order, order)]
+            names = self.raw['name1']
+            starts = np.flatnonzero(np.concatenate(([True], names[1:] != names[:-1])))
+        stops = np.append(starts[1:], n)
+        self._lig_slice = dict(zip(names[starts], zip(starts, stops)))
 
     def get_view(self, ligands, features):
         """
@@ -204,22 +296,24 @@ class Features:
             data['gaff'] = {}
         data['vaff'] = {}
         data['rmsd'] = {}
+        if self._lig_slice is None:
+            self._index_ligands()
         for ligand in ligands:
-            mask = self.raw['name1'] == ligand
-            assert sum(mask)
+            assert ligand in self._lig_slice
+            start, stop = self._lig_slice[ligand]
             if self.cnn_scores:
-                data['gscore'][ligand] = self.raw['gscore1'][mask]
-                data['gaff'][ligand] = self.raw['gaff1'][mask]
-            data['vaff'][ligand] = self.raw['vaff1'][mask]
-            data['rmsd'][ligand] = self.raw['rmsd1'][mask]
+                data['gscore'][ligand] = self.raw['gscore1'][start:stop]
+                data['gaff'][ligand] = self.raw['gaff1'][start:stop]
+            data['vaff'][ligand] = self.raw['vaff1'][start:stop]
+            data['rmsd'][ligand] = self.raw['rmsd1'][start:stop]
 
+        slices = [self._lig_slice[ligand] for ligand in ligands]
         for feature in features:
             data[feature] = {}
-            for i, ligand1 in enumerate(ligands):
-                for ligand2 in ligands[i+1:]:
-                    mask1 = self.raw['name1'] == ligand1
-                    mask2 = self.raw['name1'] == ligand2
-                    data[feature][(ligand1, ligand2)] = self.raw[feature][mask1, :][:, mask2]
+            feature_mat = self.raw[feature]
+            for i, (ligand1, (start1, stop1)) in enumerate(zip(ligands, slices)):
+                for ligand2, (start2, stop2) in zip(ligands[i+1:], slices[i+1:]):
+                    data[feature][(ligand1, ligand2)] = feature_mat[start1:stop1, start2:stop2]
 
         return data
 
@@ -256,6 +350,7 @@ class Features:
 
         if center_ligand is not None:
             center = ComputeCentroid(center_ligand.GetConformer())
+        ligset = None if ligands is None else set(ligands)
         rmsds, gscores, gaffs, vaffs, poses, names, ifps = [], [], [], [], [], [], []
         for pv in pvs:
             _rmsds = np.load(self.path('rmsd', pv=pv))
@@ -265,28 +360,39 @@ class Features:
             _vaffs = np.load(self.path('vaff', pv=pv))
             _names = np.load(self.path('name', pv=pv))
 
-            _ifps = pd.read_csv(self.path('ifp', pv=pv))
-            _ifps = [_ifps.loc[_ifps.pose==p] for p in range(max(_ifps.pose)+1)]
-
-            #Need to check for if ligand is centered here.
-            sts = Chem.ForwardSDMolSupplier(gzip.open(pv))
-            _poses = []
-            for st in sts:
-                if center_ligand is not None:
-                    lig_centroid = ComputeCentroid(st.GetConformer())
-                    displacement = lig_centroid.DirectionVector(center) * lig_centroid.Distance(center)
-                    # print(distance)
-                    if np.abs(displacement.x) > 7.5 or np.abs(displacement.y) > 7.5 or np.abs(displacement.z) > 7.5:
-                        print(f"skipped for {pv}")
-                        continue
-                _poses.append(st)
+            _ifps = pd.read_csv(self.path('ifp', pv=pv),
+                                usecols=['pose', 'label', 'protein_res', 'score'],
+                                dtype={'pose': np.int32})
+            groups = dict(list(_ifps.groupby('pose', sort=False)))
+            empty = _ifps.iloc[:0]
+            _ifps = [groups.get(p, empty) for p in range(_ifps['pose'].max()+1)]
+
+            # Reuse the poses read by compute_single_features when they were
+            # filtered against the same center ligand, releasing them from the cache.
+            if center_ligand is self.center_ligand and os.path.abspath(pv) in self._molbundles:
+                _poses = self._molbundles.pop(os.path.abspath(pv))
+            else:
+                #Need to check for if ligand is centered here.
+                sts = Chem.ForwardSDMolSupplier(gzip_open(pv))
+                _poses = []
+                for st in sts:
+                    if center_ligand is not None:
+                        lig_centroid = ComputeCentroid(st.GetConformer())
+                        displacement = lig_centroid.DirectionVector(center) * lig_centroid.Distance(center)
+                        # print(distance)
+                        if np.abs(displacement.x) > 7.5 or np.abs(displacement.y) > 7.5 or np.abs(displacement.z) > 7.5:
+                            print(f"skipped for {pv}")
+                            continue
+                    _poses.append(st)
             print(len(poses))
 
             keep = []
-            for i in range(len(_names)):
-                if ((ligands == None or (_names[i] in ligands))
-                    and sum(_names[:i] == _names[i]) < self.max_poses):
+            seen = Counter()
+            for i, _name in enumerate(_names):
+                if ((ligset is None or _name in ligset)
+                    and seen[_name] < self.max_poses):
                     keep += [i]
+                    seen[_name] += 1
             print(keep)
             rmsds += [_rmsds[keep]]
             if self.cnn_scores:
@@ -313,7 +419,7 @@ class Features:
             gscores = None
         return rmsds, gscores, gaffs, vaffs, poses, names, ifps
 
-    def compute_single_features(self, pvs, native_poses):
+    def compute_single_features(self, pvs, native_poses, processes=1):
         """
         Compute all of the single pose features (e.g. GNINA scores, RMSD to native, etc.) for the provided poses
 
@@ -323,6 +429,8 @@ class Features:
             Path to poses to compute the single pose features
         native_poses : :class:`list[str]<list>`
             Path to pose of the native ligand structures, if they exist
+        processes : int, default=1
+            Number of processes to use for computing the RMSDs and IFPs of the pose files, if -1 then use all available cores
         """
         # For single features, there is no need to keep sub-sets of ligands
         # separated,  so just merge them at the outset to simplify the rest of
@@ -360,17 +468,31 @@ class Features:
                 self.compute_name(bundle, out)
 
         print('Computing RMSDs to native poses')
+        unfinished = []
         for pv, bundle in molbundles.items():
             out = self.path('rmsd', pv=pv)
             if not os.path.exists(out):
-                self.compute_rmsd(bundle, native_poses, out)
+                unfinished += [(bundle, native_poses, out)]
+        if processes != 1:
+            mp(compute_rmsd, unfinished, processes)
+        else:
+            for args in unfinished:
+                compute_rmsd(*args)
 
         print('Computing interaction fingerprints.')
+        unfinished = []
         for pv in molbundles.keys():
-            # print(pv)
             out = self.path('ifp', pv=pv)
             if not os.path.exists(out):
-                self.compute_ifp(pv, out)
+                unfinished += [(pv, out, self.ifp_version, self.max_poses)]
+        if processes != 1:
+            mp(compute_ifp, unfinished, processes)
+        else:
+            for args in unfinished:
+                compute_ifp(*args)
+
+        # Kept for load_single_features
+        self._molbundles.update(molbundles)
 
     def compute_pair_features(self, pvs, pvs2=None, ifp=True, shape=True, mcss=True, processes=1):
         """
@@ -397,33 +519,35 @@ class Features:
         mkdir(self.root)
         rmsds1, gscores1, gaffs1, vaffs1, poses1, names1, ifps1 = self.load_single_features(pvs, center_ligand=self.center_ligand)
         out = self.path('rmsd1')
-        np.save(out, rmsds1)
-        out = self.path('gscore1')
-        np.save(out, gscores1)
-        out = self.path('gaff1')
-        np.save(out, gaffs1)
+        np.save(out, rmsds1, allow_pickle=False)
+        if self.cnn_scores:
+            out = self.path('gscore1')
+            np.save(out, gscores1, allow_pickle=False)
+            out = self.path('gaff1')
+            np.save(out, gaffs1, allow_pickle=False)
         out = self.path('vaff1')
-        np.save(out, vaffs1)
+        np.save(out, vaffs1, allow_pickle=False)
         out = self.path('name1')
-        np.save(out, names1)
+        np.save(out, names1, allow_pickle=False)
         if pvs2 is None:
             (rmsds2, gscores2, poses2, names2, ifps2
             ) = rmsds1, gscores1, poses1, names1, ifps1
         else:
-            rmsds2, gscores2, poses2, names2, ifps2 = self.load_single_features(pvs2)
+            rmsds2, gscores2, _, _, poses2, names2, ifps2 = self.load_single_features(pvs2)
             out = self.path('rmsd2')
-            np.save(out, rmsds2)
-            out = self.path('gscore2')
-            np.save(out, gscores2)
+            np.save(out, rmsds2, allow_pickle=False)
+            if self.cnn_scores:
+                out = self.path('gscore2')
+                np.save(out, gscores2, allow_pickle=False)
             out = self.path('name2')
-            np.save(out, names2)
+            np.save(out, names2, allow_pickle=False)
 
         if ifp:
             print('Computing interaction similarities.')
             for feature in self.ifp_features:
                 out = self.path(feature)
                 if not os.path.exists(out):
-                    self.compute_ifp_pair(ifps1, ifps2,  feature, out, processes=processes)
+                    self.compute_ifp_pair(ifps1, ifps2,  feature, out)
 
         if shape:
             print('Computing shape similarities.')
@@ -450,12 +574,10 @@ class Features:
             Path to `.npy` file to save all of the pose names
         """
 
-        names = []
+        # every pose in the file is named after the docked ligand
         docked_fname = os.path.basename(out).split('.')[0]
         name = docked_fname.replace('-docked_name','')
-        for idx, st in enumerate(bundle):
-            names += [name]
-        np.save(out, names)
+        np.save(out, np.full(len(bundle), name), allow_pickle=False)
 
     def compute_gaff(self, bundle, out):
         """
@@ -472,7 +594,7 @@ class Features:
         gaffs = []
         for idx, st in enumerate(bundle):
             gaffs += [float(st.GetProp('CNNaffinity'))]
-        np.save(out, gaffs)
+        np.save(out, gaffs, allow_pickle=False)
 
     def compute_gscore(self, bundle, out):
         """
@@ -489,7 +611,7 @@ class Features:
         gscores = []
         for idx, st in enumerate(bundle):
             gscores += [logit(float(st.GetProp('CNNscore')))]
-        np.save(out, gscores)
+        np.save(out, gscores, allow_pickle=False)
 
     def compute_vaff(self, bundle, out):
         """
@@ -507,7 +629,7 @@ class Features:
         vaffs = []
         for idx, st in enumerate(bundle):
             vaffs += [float(st.GetProp('minimizedAffinity'))]
-        np.save(out, vaffs)
+        np.save(out, vaffs, allow_pickle=False)
 
     def compute_rmsd(self, bundle, native_poses, out):
         """
@@ -523,19 +645,7 @@ class Features:
             Path to `.npy` file to save all of the pose RMSDs
         """
         
-        rmsds = []
-        name = os.path.basename(out).split('-')[0]
-        # print(name)
-        if name in native_poses:
-            native = native_poses[name]
-            for idx, st in enumerate(bundle):
-                rmsd = Chem.CalcRMS(native, st)
-                rmsds += [rmsd]
-        else:
-            # print(name)
-            rmsds = [-1] * len(bundle)
-
-        np.save(out, rmsds)
+        compute_rmsd(bundle, native_poses, out)
 
     def compute_ifp(self, pv, out):
         """
@@ -550,11 +660,9 @@ class Features:
         
         """
         
-        from open_combind.features.ifp import ifp
-        settings = IFP[self.ifp_version]
-        ifp(settings, pv, out, self.max_poses)
+        compute_ifp(pv, out, self.ifp_version, self.max_poses)
 
-    def compute_ifp_pair(self, ifps1, ifps2, feature, out, processes=1):
+    def compute_ifp_pair(self, ifps1, ifps2, feature, out):
         """
         Compute the pseudo-Tanimoto similarity between the given IFPs for the given features
         
@@ -568,17 +676,11 @@ class Features:
             List of IFP features to calculate the pseudo-Tanimoto similarity between
         out : str
             Path to `.npy` file to save all of the pairwise IFPs
-        processes : int, default=1
-            Number of processes to use for computing the pairwise features, if -1 then use all available cores
         """
         
-        if processes != 1:
-            from open_combind.features.ifp_similarity import ifp_tanimoto_mp
-            tanimotos = ifp_tanimoto_mp(ifps1, ifps2, feature, processes)
-        else:
-            from open_combind.features.ifp_similarity import ifp_tanimoto
-            tanimotos = ifp_tanimoto(ifps1, ifps2, feature)
-        np.save(out, tanimotos)
+        from open_combind.features.ifp_similarity import ifp_tanimoto
+        tanimotos = ifp_tanimoto(ifps1, ifps2, feature)
+        np.save(out, tanimotos.astype(PAIR_DTYPE), allow_pickle=False)
 
     def compute_shape(self, poses1, poses2, out, processes=1):
         """
@@ -603,7 +705,7 @@ class Features:
             # More efficient to have longer pose list provided as second argument.
             # This only matters for screening.
             sims = shape(poses2, poses1, version=self.shape_version).T
-        np.save(out, sims)
+        np.save(out, sims.astype(PAIR_DTYPE), allow_pickle=False)
 
     def compute_mcss(self, poses1, poses2, out, processes=1):
         """
@@ -619,11 +721,23 @@ class Features:
             Path to `.npy` file to save all of the MCSS RMSDs
         processes : int, default=1
             Number of processes to use for computing the pairwise features, if -1 then use all available cores
-        """
+
+        Notes
+        -----
+        The MCSS of each pair of ligands is cached in ``{root}/mcss_cache_{tag}.json``, where the tag identifies
+        the MCSS parameters and RDKit version, so that only the RMSDs need to be recomputed when the features
+        are regenerated for an overlapping set of ligands.
+        """
+        from open_combind.features.mcss import MCSS_CACHE_TAG, read_mcss_cache, write_mcss_cache
+        cache = self.path(f'mcss_cache_{MCSS_CACHE_TAG}.json', base=True)
+        memo = {}
+        if os.path.exists(cache):
+            memo = read_mcss_cache(cache)
         if processes != 1:
             from open_combind.features.mcss import mcss_mp
-            rmsds = mcss_mp(poses1, poses2, processes)
+            rmsds = mcss_mp(poses1, poses2, processes, memo=memo)
         else:
             from open_combind.features.mcss import mcss
-            rmsds = mcss(poses1, poses2)
-        np.save(out, rmsds)
+            rmsds = mcss(poses1, poses2, memo=memo)
+        write_mcss_cache(cache, memo)
+        np.save(out, rmsds.astype(PAIR_DTYPE), allow_pickle=False)
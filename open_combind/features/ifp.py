@@ -10,7 +10,7 @@ import numpy as np
 import pandas as pd
 from rdkit.Chem import MolFromSmarts,ForwardSDMolSupplier,MolFromPDBFile, AddHs
 from rdkit.Chem.rdForceFieldHelpers import UFFGetMoleculeForceField, OptimizeMolecule
-import gzip
+from open_combind.utils import gzip_open
 
 def resname(atom):
     """
@@ -845,7 +845,7 @@ def fingerprint_poseviewer(input_file, poses, settings):
 
     # print(input_file)
     fps = []
-    with gzip.open(input_file) as fp:
+    with gzip_open(input_file) as fp:
         mols = ForwardSDMolSupplier(fp, removeHs=False)
         rdk_prot = MolFromPDBFile(prot_file,removeHs=False)
         if rdk_prot is None:
@@ -1,6 +1,5 @@
 import pandas as pd
 import numpy as np
-from open_combind.utils import mp
 
 def merge_hbonds(ifp):
     """
@@ -31,55 +30,62 @@ def merge_hbonds(ifp):
     ifp.loc[mask, 'label'] = 'hbond'
     return ifp
 
-def ifp_tanimoto(ifps1, ifps2, feature):
+def feature_scores(ifps, feature):
     """
-    Computes the tanimoto distance between ifp1 and ifp2 for feature.
+    Collect the scores of `feature` from each IFP into a single DataFrame.
 
     Parameters
     ----------
-    ifps1 : list of :class:`~pandas.DataFrame`
-        List of IFP files read into pandas DataFrames.
-    ifps2 : list of :class:`~pandas.DataFrame`
+    ifps : list of :class:`~pandas.DataFrame`
         List of IFP files read into pandas DataFrames.
     feature : str
-        Feature to compute similarity for.
+        Feature to collect the scores of.
 
     Returns
     -------
-    :class:`~numpy.ndarray`
-        Similarity matrix.
+    :class:`~pandas.DataFrame`
+        Columns ``pose_idx`` (index of the IFP in `ifps`), ``protein_res`` and ``score``.
     """
+    scores = pd.concat([ifp[['label', 'protein_res', 'score']] for ifp in ifps],
+                       ignore_index=True, sort=False)
+    scores['pose_idx'] = np.repeat(np.arange(len(ifps)), [len(ifp) for ifp in ifps])
     if feature == 'hbond':
-        ifps1 = [merge_hbonds(ifp) for ifp in ifps1]
-        ifps2 = [merge_hbonds(ifp) for ifp in ifps2]
-
-    ifps1 = [ifp.loc[ifp.label == feature] for ifp in ifps1]
-    ifps2 = [ifp.loc[ifp.label == feature] for ifp in ifps2]
+        scores = merge_hbonds(scores)
+    scores = scores.loc[scores.label == feature]
+    return scores[['pose_idx', 'protein_res', 'score']]
 
-    ifps1 = [ifp.set_index('protein_res') for ifp in ifps1]
-    ifps2 = [ifp.set_index('protein_res') for ifp in ifps2]
-
-    sims = np.zeros((len(ifps1), len(ifps2)))
-    for i, ifp1 in enumerate(ifps1):
-        for j, ifp2 in enumerate(ifps2):
-            if j > i:
-                break
-            total = ifp1['score'].sum() + ifp2['score'].sum()
-            overlap = ifp1.join(ifp2, rsuffix='_2', how='inner')
-            overlap = overlap['score']**0.5 * overlap['score_2']**0.5
-            overlap = overlap.sum()
-
-            sims[i, j] = (1 + overlap) / (2 + total - overlap)
-    sims = mirror_bottom_triangle(sims)
+def score_matrix(scores, n_poses, residues):
+    """
+    Scatter the scores from :func:`feature_scores` into a dense (poses x residues) matrix.
 
-    return sims
+    Parameters
+    ----------
+    scores : :class:`~pandas.DataFrame`
+        Scores as returned by :func:`feature_scores`.
+    n_poses : int
+        Number of poses (rows) in the matrix.
+    residues : :class:`~pandas.Index`
+        Protein residues giving the column order. Must contain every residue in `scores`.
 
-def ifp_tanimoto_mp(ifps1, ifps2, feature, processes):
+    Returns
+    -------
+    :class:`~numpy.ndarray`
+        Score of each residue interaction for each pose, zero where there is no interaction.
     """
-    Multiprocesing version of `ifp_tanimoto_mp`.
+    cols = residues.get_indexer(scores['protein_res'])
+    assert np.all(cols >= 0), "residues is missing some of the interacting protein residues"
+    matrix = np.zeros((n_poses, len(residues)))
+    matrix[scores['pose_idx'].to_numpy(), cols] = scores['score'].to_numpy()
+    return matrix
 
+def ifp_tanimoto(ifps1, ifps2, feature):
+    """
     Computes the tanimoto distance between ifp1 and ifp2 for feature.
 
+    The IFPs are stacked into dense (poses x residues) score matrices so the
+    overlap for every pair of poses is a single matrix product of the square
+    roots of the scores.
+
     Parameters
     ----------
     ifps1 : list of :class:`~pandas.DataFrame`
@@ -88,68 +94,25 @@ def ifp_tanimoto_mp(ifps1, ifps2, feature, processes):
         List of IFP files read into pandas DataFrames.
     feature : str
         Feature to compute similarity for.
-    processes : int
-        Number of processes to use.
 
     Returns
     -------
     :class:`~numpy.ndarray`
         Similarity matrix.
-
-    See Also
-    --------
-    ifp_tanimoto: serial version of the function.
     """
-    if feature == 'hbond':
-        ifps1 = [merge_hbonds(ifp) for ifp in ifps1]
-        ifps2 = [merge_hbonds(ifp) for ifp in ifps2]
+    scores1 = feature_scores(ifps1, feature)
+    scores2 = scores1 if ifps2 is ifps1 else feature_scores(ifps2, feature)
+    residues = pd.Index(pd.unique(pd.concat([scores1['protein_res'], scores2['protein_res']])))
 
-    ifps1 = [ifp.loc[ifp.label == feature] for ifp in ifps1]
-    ifps2 = [ifp.loc[ifp.label == feature] for ifp in ifps2]
+    matrix1 = score_matrix(scores1, len(ifps1), residues)
+    matrix2 = matrix1 if scores2 is scores1 else score_matrix(scores2, len(ifps2), residues)
 
-    ifps1 = [ifp.set_index('protein_res') for ifp in ifps1]
-    ifps2 = [ifp.set_index('protein_res') for ifp in ifps2]
+    total = matrix1.sum(axis=1)[:, None] + matrix2.sum(axis=1)[None, :]
+    overlap = np.sqrt(matrix1) @ np.sqrt(matrix2).T
+    sims = (1 + overlap) / (2 + total - overlap)
 
-    sims = np.zeros((len(ifps1), len(ifps2)))
-    unfinished = [(ifp1, i, ifps2) for i, ifp1 in enumerate(ifps1)]
-    results = mp(calc_sim,unfinished,processes)
-    for sims_row, i in results:
-        sims[i,:] = sims_row
-    
-    sims = mirror_bottom_triangle(sims)
     return sims
 
-def calc_sim(ifp1,i,ifps2):
-    """
-    Calculates the similarity between ifp1 and each ifp2 in ifps2.
-
-    Parameters
-    ----------
-    ifp1 : :class:`~pandas.DataFrame`
-        IFP file read into a pandas DataFrame.
-    i : int
-        Index of ifp1 in ifps1.
-    ifps2 : list of :class:`~pandas.DataFrame`
-        List of IFP files read into pandas DataFrames.
-
-    Returns
-    -------
-    :class:`~numpy.ndarray`
-        1D matrix of the similarity between ifp1 and ifps2
-    """
-
-    sims = np.zeros((1,len(ifps2)))
-    for j, ifp2 in enumerate(ifps2):
-        if j > i:
-            break
-        total = ifp1['score'].sum() + ifp2['score'].sum()
-        overlap = ifp1.join(ifp2, rsuffix='_2', how='inner')
-        overlap = overlap['score']**0.5 * overlap['score_2']**0.5
-        overlap = overlap.sum()
-        sims[0,j] = (1 + overlap) / (2 + total - overlap)
-
-    return (sims, i)
-
 def mirror_bottom_triangle(matrix):
     """
     Mirrors the bottom triangle of a matrix to the top triangle.
@@ -3,6 +3,8 @@ import numpy as np
 import subprocess
 import os
 import itertools
+import json
+import rdkit
 from rdkit.Chem import AllChem as Chem
 from rdkit.Chem import rdFMCS
 from rdkit.Chem.rdmolops import ReplaceSubstructs
@@ -10,6 +12,12 @@ from rdkit.Chem.AllChem import AssignBondOrdersFromTemplate
 # from plumbum.cmd import obrms
 from open_combind.utils import mp
 
+#: Version of the MCSS parameters and matching, bump when :func:`setup_MCS_params` or
+#: :func:`compute_mcss` change so that cached MCSS results are not reused
+MCSS_VERSION = '1'
+#: Tag identifying the MCSS implementation, used to name MCSS cache files
+MCSS_CACHE_TAG = f'{MCSS_VERSION}_rdkit{rdkit.__version__}'
+
 class CompareHalogens(rdFMCS.MCSAtomCompare):
     """
     Atom comparator for MCS that allows halogens to match with each other.
@@ -48,7 +56,7 @@ class CompareHalogens(rdFMCS.MCSAtomCompare):
 # of the smaller ligand. Hydrogen atoms were not included in the substructure nor when
 # determining the total number of atoms in each ligand.
 
-def mcss(sts1, sts2):
+def mcss(sts1, sts2, memo=None):
     """
     Computes root mean square deviation (RMSD) between the maximum common substructure (MCSS) for all pairs in the two lists of `Mol`s.
 
@@ -58,6 +66,8 @@ def mcss(sts1, sts2):
         Set of ligand poses as :class:`~rdkit.Chem.rdchem.Mol` s to compute the MCSS RMSD with `sts2`
     sts2 : :class:`list[Mol]<list>`
         Set of ligand poses as :class:`~rdkit.Chem.rdchem.Mol` s to compute the MCSS RMSD with `sts1`
+    memo : dict, default=None
+        Previously computed MCSS results keyed by the pair of ligand SMARTS, updated in place with any newly computed MCSS
 
     Returns
     -------
@@ -77,11 +87,14 @@ def mcss(sts1, sts2):
 
     """
 
-    memo = {}
+    if memo is None:
+        memo = {}
     params = setup_MCS_params()
 
     bad_apples = []
     rmsds = []
+    smarts2 = [Chem.MolToSmarts(st2) for st2 in sts2]
+    n_atoms2 = [st2.GetNumHeavyAtoms() for st2 in sts2]
     for i, st1 in enumerate(sts1):
         n_st1_atoms = st1.GetNumHeavyAtoms()
         sma1 = Chem.MolToSmarts(st1)
@@ -89,14 +102,14 @@ def mcss(sts1, sts2):
         for j, st2 in enumerate(sts2):
             if j > i:  # only calculate lower triangle
                 break
-            n_st2_atoms = st2.GetNumHeavyAtoms()
-            sma2 = Chem.MolToSmarts(st2)
+            n_st2_atoms = n_atoms2[j]
+            sma2 = smarts2[j]
             if (sma1, sma2) in memo:
                 mcss, n_mcss_atoms, keep_idxs = memo[(sma1, sma2)]
             else:
                 mcss, n_mcss_atoms, keep_idxs = compute_mcss(st1, st2, params)
                 memo[(sma1, sma2)] = (mcss, n_mcss_atoms, keep_idxs)
-                memo[(sma2, sma1)] = (mcss, n_mcss_atoms, {'st1':keep_idxs['st2'],'st2':keep_idxs['st1']})
+                memo[(sma2, sma1)] = (mcss, n_mcss_atoms, swap_keep_idxs(keep_idxs))
 
             if (2*n_mcss_atoms < min(n_st1_atoms, n_st2_atoms)):
                 # or n_mcss_atoms <= 10):
@@ -112,7 +125,7 @@ def mcss(sts1, sts2):
     filled_matrix = rmsds_bottom + rmsds_bottom.T - np.diag(np.diag(rmsds_bottom))
     return np.where(filled_matrix<0, np.inf, filled_matrix)
 
-def mcss_mp(sts1, sts2, processes=1):
+def mcss_mp(sts1, sts2, processes=1, memo=None):
     """
     Computes root mean square deviation (RMSD) between the maximum common substructure (MCSS) for atoms in two poseviewer files.
 
@@ -126,6 +139,8 @@ def mcss_mp(sts1, sts2, processes=1):
         Set of ligand poses as :class:`~rdkit.Chem.rdchem.Mol` s to compute the MCSS RMSD with `sts1`
     processes : int, default=1
         Number of processes to use for computing the pairwise features, if -1 then use all available cores
+    memo : dict, default=None
+        Previously computed MCSS results keyed by the pair of ligand SMARTS, updated in place with any newly computed MCSS
 
     Returns
     -------
@@ -137,6 +152,8 @@ def mcss_mp(sts1, sts2, processes=1):
     mcss : non-parallelized
     """
 
+    if memo is None:
+        memo = {}
     unfinished = []
     mcss_calc_unfinished = []
     group_st1 = group_mols_by_SMARTS(sts1)
@@ -144,16 +161,19 @@ def mcss_mp(sts1, sts2, processes=1):
     for g1, g2 in itertools.product(group_st1, group_st2):
         if (g2[0],g2[1],g1[0],g1[1]) in unfinished:
             continue
-        mcss_calc_unfinished += [(g1[0][0], g2[0][0])]
+        if (g1[2], g2[2]) not in memo:
+            mcss_calc_unfinished += [(g1[0][0], g2[0][0])]
         unfinished += [(g1[0],g1[1],g2[0],g2[1])]
 
     print("calculating mcss first")
     # TODO: make the number of processes for computing the mcss available to the user
     # this should control to some extent, the amount of memory that is used. More processes == more memory
     mcss_results = mp(compute_mcss_mp, mcss_calc_unfinished, min(processes, 3), maxtasksperchild=3)
-    keys, vals = zip(*mcss_results)
+    for (sma1, sma2), (mcss, n_mcss_atoms, keep_idxs) in (mcss_results or []):
+        memo[(sma1, sma2)] = (mcss, n_mcss_atoms, keep_idxs)
+        memo[(sma2, sma1)] = (mcss, n_mcss_atoms, swap_keep_idxs(keep_idxs))
     global mcss_info
-    mcss_info = dict(zip(keys,vals))
+    mcss_info = memo
 
     print("now calculating rmsds")
     results = mp(compute_mcss_rmsd_mp,unfinished,processes)
@@ -229,9 +249,13 @@ def compute_mcss_rmsd_mp(mols1, idxs1, mols2, idxs2):
             else:
                 rmsds.append((i,j,-1))
     else:
+        # The MCSS mapping is shared by every pose of the two ligands, so only
+        # build the substructures of each pose once
+        submols1 = [mcss_submols(mol, keep_idxs['st1'], names=False) for mol in mols1]
+        submols2 = [mcss_submols(mol, keep_idxs['st2'], names=False) for mol in mols2]
         # Get the RMSD for each unique pair with one pose from each group
         for i,j in itertools.product(range(len(mols1)), range(len(mols2))):
-            rmsd = compute_mcss_rmsd(mols1[i], mols2[j], keep_idxs, names=False)
+            rmsd = min_submol_rmsd(submols1[i], submols2[j])
             if idxs1[i] > idxs2[j]:
                 rmsds.append((idxs2[j], idxs1[i],rmsd))
             else:
@@ -268,19 +292,129 @@ def compute_mcss_rmsd(st1, st2, keep_idxs, names=True):
     compute_mcss_rmsd_mp : used during multiprocessing
     """
 
-    rmsd = float('inf')
-    for kpatom_idx1 in keep_idxs['st1']:
-        ss1 = subMol(st1,kpatom_idx1)
+    return min_submol_rmsd(mcss_submols(st1, keep_idxs['st1'], names),
+                           mcss_submols(st2, keep_idxs['st2'], names))
+
+def mcss_submols(st, matches, names=True):
+    """
+    Get the substructures of a molecule for each of the matches of the MCSS.
+
+    Parameters
+    ----------
+    st : :class:`~rdkit.Chem.rdchem.Mol`
+        Molecule to get the substructures of
+    matches : :class:`list[list[int]]<list>`
+        Atom indices of each match of the MCSS in `st`
+    names : bool, default=True
+        Give the created sub-molecules the same name as the original molecule (helps with errors)
+
+    Returns
+    -------
+    :class:`list[Mol]<list>`
+        Substructure of `st` for each match
+    """
+
+    submols = []
+    for match in matches:
+        ss = subMol(st, match)
         if names:
-            ss1.SetProp('_Name', st1.GetProp('_Name'))
-        for kpatom_idx2 in keep_idxs['st2']:
-            ss2 = subMol(st2,kpatom_idx2)
-            if names:
-                ss2.SetProp('_Name', st2.GetProp('_Name'))
+            ss.SetProp('_Name', st.GetProp('_Name'))
+        submols += [ss]
+    return submols
+
+def min_submol_rmsd(submols1, submols2):
+    """
+    Compute the minimum RMSD over all pairs of MCSS substructures of two molecules.
+
+    Parameters
+    ----------
+    submols1 : :class:`list[Mol]<list>`
+        MCSS substructures of molecule 1, from :func:`mcss_submols`
+    submols2 : :class:`list[Mol]<list>`
+        MCSS substructures of molecule 2, from :func:`mcss_submols`
+
+    Returns
+    -------
+    float
+        Minimum RMSD between the substructures of `submols1` and `submols2`
+    """
+
+    rmsd = float('inf')
+    for ss1 in submols1:
+        for ss2 in submols2:
             _rmsd = calculate_rmsd(ss1, ss2)
             rmsd = min(_rmsd, rmsd)
     return rmsd
 
+def swap_keep_idxs(keep_idxs):
+    """
+    Swap the molecules of the substructure indices returned by :func:`compute_mcss`.
+
+    Parameters
+    ----------
+    keep_idxs : dict
+        Dictionary with keys 'st1' and 'st2' that contain lists of indices of atoms to keep in the substructure
+
+    Returns
+    -------
+    dict
+        `keep_idxs` for the MCSS computed with the molecules in the opposite order
+    """
+
+    return {'st1': keep_idxs['st2'], 'st2': keep_idxs['st1'],
+            'canceled': keep_idxs.get('canceled', False)}
+
+def read_mcss_cache(fname):
+    """
+    Read MCSS results written by :func:`write_mcss_cache`.
+
+    Parameters
+    ----------
+    fname : str
+        Path to the JSON cache file
+
+    Returns
+    -------
+    dict
+        MCSS results keyed by the pair of ligand SMARTS, as used by the `memo` of :func:`mcss` and :func:`mcss_mp`
+    """
+
+    with open(fname) as fp:
+        entries = json.load(fp)
+    memo = {}
+    for sma1, sma2, mcss, n_mcss_atoms, idxs1, idxs2 in entries:
+        keep_idxs = {'st1': tuple(map(tuple, idxs1)), 'st2': tuple(map(tuple, idxs2)),
+                     'canceled': False}
+        memo[(sma1, sma2)] = (mcss, n_mcss_atoms, keep_idxs)
+        memo[(sma2, sma1)] = (mcss, n_mcss_atoms, swap_keep_idxs(keep_idxs))
+    return memo
+
+def write_mcss_cache(fname, memo):
+    """
+    Write MCSS results to a JSON cache file.
+
+    Results where :func:`~rdkit.Chem.rdFMCS.FindMCS` timed out are not written, as the
+    timeout depends on the load of the machine rather than on the ligands.
+
+    Parameters
+    ----------
+    fname : str
+        Path to the JSON cache file
+    memo : dict
+        MCSS results keyed by the pair of ligand SMARTS, as used by the `memo` of :func:`mcss` and :func:`mcss_mp`
+    """
+
+    entries = []
+    for (sma1, sma2), (mcss, n_mcss_atoms, keep_idxs) in memo.items():
+        # the reverse orientation is rebuilt when reading
+        if keep_idxs.get('canceled', False) or sma1 > sma2:
+            continue
+        entries += [[sma1, sma2, mcss, n_mcss_atoms,
+                     [list(idx) for idx in keep_idxs['st1']],
+                     [list(idx) for idx in keep_idxs['st2']]]]
+    with open(fname, 'w') as fp:
+        json.dump(entries, fp)
+
 def get_info_from_results(mcss_res):
     """
     Check the results of :func:`~rdkit.Chem.rdFMCS.FindMCS` to check if finished successfully.
@@ -335,7 +469,8 @@ def compute_mcss(st1, st2, current_params):
     int
         The number of heavy atoms in the MCSS
     dict
-        Dictionary with keys 'st1' and 'st2' that contain lists of indices of atoms to keep in the substructure
+        Dictionary with keys 'st1' and 'st2' that contain lists of indices of atoms to keep in the substructure,
+        and 'canceled' which is True if :func:`~rdkit.Chem.rdFMCS.FindMCS` timed out
 
     See Also
     --------
@@ -345,6 +480,7 @@ def compute_mcss(st1, st2, current_params):
     try:
         res = rdFMCS.FindMCS([st1,st2], current_params)
         mcss, num_atoms, mcss_mol = get_info_from_results(res)
+        canceled = res.canceled
         if not res.canceled:
             pose1 = subMol(st1,st1.GetSubstructMatch(mcss_mol))
             pose2 = subMol(st2,st2.GetSubstructMatch(mcss_mol))
@@ -360,9 +496,11 @@ def compute_mcss(st1, st2, current_params):
         current_params.BondCompareParameters.MatchFusedRingsStrict = False
         newres = rdFMCS.FindMCS([st1, st2], current_params)
         mcss, num_atoms, mcss_mol = get_info_from_results(newres)
+        canceled = newres.canceled
         current_params.BondCompareParameters.MatchFusedRings = False
     substruct_idx = {'st1': st1.GetSubstructMatches(mcss_mol),
-                    'st2': st2.GetSubstructMatches(mcss_mol)}
+                    'st2': st2.GetSubstructMatches(mcss_mol),
+                    'canceled': canceled}
 
     return mcss, num_atoms, substruct_idx#, rmv_idx
 
@@ -189,7 +189,8 @@ def ligprep(smiles, root='ligands', multiplex=False, ligand_names="ID",
         # ligsplit(smiles, root, multiplex=multiplex, processes=processes,
         #         num_confs=num_confs, confgen=confgen, maxIters=max_iterations)
 
-def dock_ligands(ligands, template=None, dock_file=None, root='docking', screen=False, slurm=False, now=False):
+def dock_ligands(ligands, template=None, dock_file=None, root='docking', screen=False, slurm=False, now=False,
+                 processes=1, jobs=1):
     """
     Generate GNINA docking commands to dock `ligands` to `template`.
 
@@ -210,6 +211,10 @@ def dock_ligands(ligands, template=None, dock_file=None, root='docking', screen=
         Create a tarball including all files needed for docking and update docking command to use tarball paths
     now : bool, default=False
         After generating the docking commands, run the docking
+    processes : int, default=1
+        Number of CPUs for each GNINA run to use when `now` is set, -1 implies all cores.
+    jobs : int, default=1
+        Number of GNINA runs to perform at the same time when `now` is set, -1 implies all cores.
     """
 
     from open_combind.dock.dock import dock
@@ -237,7 +242,8 @@ def dock_ligands(ligands, template=None, dock_file=None, root='docking', screen=
         ligs.append(ligand)
         names.append(name)
     print(f"Writing docking file for {len(ligs)} ligands")
-    dock(template, ligands, root, names, not screen, slurm=slurm, now=now, infile=dock_file)
+    dock(template, ligands, root, names, not screen, slurm=slurm, now=now, infile=dock_file,
+         processes=processes, jobs=jobs)
 
 ################################################################################
 
@@ -294,7 +300,7 @@ def featurize(root, poseviewers, native='structures/ligands/*_lig.sdf',
                         max_poses=max_poses, cnn_scores=not no_cnn, template=template_file, check_center_ligs=check_center_ligs)
 
     print(poseviewers)
-    features.compute_single_features(poseviewers, native_poses=native_poses)
+    features.compute_single_features(poseviewers, native_poses=native_poses, processes=processes)
 
     if screen:
         assert len(poseviewers) == 2
@@ -384,7 +390,7 @@ def extract_top_poses(scores, original_pvs):
     Write top-scoring poses to a single file.
     """
     from rdkit import Chem
-    import gzip
+    from open_combind.utils import gzip_open
 
     out = scores.replace('.csv', '.sdf.gz')
     scores = pd.read_csv(scores).set_index('ID')
@@ -394,7 +400,7 @@ def extract_top_poses(scores, original_pvs):
     counts = {}
     written = []
     for pv in original_pvs:
-        sts = Chem.ForwardSDMolSupplier(gzip.open(pv))
+        sts = Chem.ForwardSDMolSupplier(gzip_open(pv))
         for st in sts:
             name = st.GetProp("_Name")
             if name not in counts:
@@ -76,7 +76,7 @@ def featurize(root, poseviewers, native_loc, ifp_version, mcss_custom,
                         max_poses=max_poses, cnn_scores=not no_cnn,template=template_file,check_center_ligs=check_center_ligs)
     if not skip_featurization:
 
-        features.compute_single_features(poseviewers,native_poses=native_loc)
+        features.compute_single_features(poseviewers,native_poses=native_loc, processes=processes)
 
         features.compute_pair_features(poseviewers,
                                        mcss=not no_mcss, shape=use_shape, processes=processes)
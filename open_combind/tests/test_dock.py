@@ -0,0 +1,23 @@
+import pytest
+
+from open_combind.dock.dock import dock
+
+
+def test_dock_skips_docked_ligands(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	with open('rec.template', 'w') as fp:
+		fp.write('gnina -r structures/proteins/rec_prot.pdb --autobox_ligand structures/ligands/rec_lig.sdf\n')
+	names = ['lig1', 'lig2', 'lig3']
+	ligands = ['ligands/{}.sdf'.format(name) for name in names]
+
+	# lig2 already has docked poses, so only lig1 and lig3 are written
+	(tmp_path / 'docking').mkdir()
+	(tmp_path / 'docking' / 'lig2-docked.sdf.gz').touch()
+	dock('rec.template', ligands, 'docking', names, False)
+
+	with open('rec_prot_docking_file.txt') as fp:
+		lines = fp.readlines()
+	assert len(lines) == 2
+	assert lines[0].startswith('gnina -r structures/proteins/rec_prot.pdb')
+	assert '-l ligands/lig1.sdf -o docking/lig1-docked.sdf.gz' in lines[0]
+	assert '-l ligands/lig3.sdf -o docking/lig3-docked.sdf.gz' in lines[1]
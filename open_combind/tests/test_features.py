@@ -0,0 +1,46 @@
+import pytest
+import numpy as np
+
+from open_combind.features.features import Features
+
+
+def mask_view(raw, ligands, features):
+	# get_view as computed with boolean masks over name1
+	data = {'gscore': {}, 'gaff': {}, 'vaff': {}, 'rmsd': {}}
+	for ligand in ligands:
+		mask = raw['name1'] == ligand
+		for key in ['gscore', 'gaff', 'vaff', 'rmsd']:
+			data[key][ligand] = raw[key + '1'][mask]
+	for feature in features:
+		data[feature] = {}
+		for i, ligand1 in enumerate(ligands):
+			for ligand2 in ligands[i+1:]:
+				mask1 = raw['name1'] == ligand1
+				mask2 = raw['name1'] == ligand2
+				data[feature][(ligand1, ligand2)] = raw[feature][mask1, :][:, mask2]
+	return data
+
+@pytest.mark.parametrize('names', [['a', 'a', 'b', 'b', 'b', 'c'],
+                                   ['b', 'a', 'c', 'a', 'b', 'c', 'b']])
+def test_get_view_matches_masks(tmp_path, names):
+	rng = np.random.default_rng(0)
+	n = len(names)
+	raw = {'name1': np.array(names)}
+	for key in ['gscore1', 'gaff1', 'vaff1', 'rmsd1']:
+		raw[key] = rng.random(n)
+	for feature in ['mcss', 'contact']:
+		raw[feature] = rng.random((n, n))
+
+	features = Features(str(tmp_path))
+	features.raw = {key: value.copy() for key, value in raw.items()}
+	ligands = ['a', 'b', 'c']
+	data = features.get_view(ligands, ['mcss', 'contact'])
+	expected = mask_view(raw, ligands, ['mcss', 'contact'])
+
+	for key in ['gscore', 'gaff', 'vaff', 'rmsd']:
+		for ligand in ligands:
+			assert np.array_equal(data[key][ligand], expected[key][ligand])
+	for feature in ['mcss', 'contact']:
+		assert data[feature].keys() == expected[feature].keys()
+		for pair in expected[feature]:
+			assert np.array_equal(data[feature][pair], expected[feature][pair])
@@ -0,0 +1,32 @@
+import pytest
+import numpy as np
+import pandas as pd
+
+from open_combind.features.ifp_similarity import ifp_tanimoto, merge_hbonds
+
+ifps = pd.read_csv('open_combind/tests/3ZPR_lig-to-2VT4_ifp.csv')
+ifps = [ifps.loc[ifps.pose == p] for p in range(20)]
+
+def reference_tanimoto(ifps, feature):
+	if feature == 'hbond':
+		ifps = [merge_hbonds(ifp.copy()) for ifp in ifps]
+	ifps = [ifp.loc[ifp.label == feature].set_index('protein_res') for ifp in ifps]
+	sims = np.zeros((len(ifps), len(ifps)))
+	for i, ifp1 in enumerate(ifps):
+		for j, ifp2 in enumerate(ifps):
+			total = ifp1['score'].sum() + ifp2['score'].sum()
+			overlap = ifp1.join(ifp2, rsuffix='_2', how='inner')
+			overlap = (overlap['score']**0.5 * overlap['score_2']**0.5).sum()
+			sims[i, j] = (1 + overlap) / (2 + total - overlap)
+	return sims
+
+@pytest.mark.parametrize('feature', ['hbond', 'saltbridge', 'contact'])
+def test_ifp_tanimoto(feature):
+	sims = ifp_tanimoto(ifps, ifps, feature)
+	assert sims.shape == (20, 20)
+	assert np.allclose(sims, reference_tanimoto(ifps, feature))
+
+def test_ifp_tanimoto_rectangular():
+	sims = ifp_tanimoto(ifps[:5], ifps, 'contact')
+	assert sims.shape == (5, 20)
+	assert np.allclose(sims, reference_tanimoto(ifps, 'contact')[:5])
@@ -0,0 +1,21 @@
+import pytest
+
+from open_combind.features.mcss import read_mcss_cache, write_mcss_cache, swap_keep_idxs
+
+
+def test_mcss_cache_roundtrip(tmp_path):
+	keep_idxs = {'st1': ((0, 1, 2),), 'st2': ((2, 1, 0), (0, 1, 2)), 'canceled': False}
+	canceled = {'st1': ((0,),), 'st2': ((3,),), 'canceled': True}
+	memo = {('[#6]-[#8]', '[#6]-[#7]'): ('[#6]', 1, keep_idxs),
+			('[#6]-[#7]', '[#6]-[#8]'): ('[#6]', 1, swap_keep_idxs(keep_idxs)),
+			('[#6]-[#9]', '[#6]-[#17]'): ('[#6]', 1, canceled),
+			('[#6]-[#17]', '[#6]-[#9]'): ('[#6]', 1, swap_keep_idxs(canceled))}
+
+	fname = str(tmp_path / 'mcss_cache.json')
+	write_mcss_cache(fname, memo)
+	cached = read_mcss_cache(fname)
+
+	# timed out MCSS are not persisted
+	assert set(cached) == {('[#6]-[#8]', '[#6]-[#7]'), ('[#6]-[#7]', '[#6]-[#8]')}
+	for key in cached:
+		assert cached[key] == memo[key]
@@ -2,6 +2,11 @@ from multiprocessing import Pool
 import os
 import numpy as np
 from rdkit import Chem
+try:
+    # ISA-L (the optional isal package) decompresses several times faster than zlib
+    from isal.igzip import open as gzip_open
+except ImportError:
+    from gzip import open as gzip_open
 
 def np_load(fname, halt=True, delete=False):
     """
@@ -76,8 +81,7 @@ def get_pose(pv, pose):
         The selected pose.
     """
     if os.path.splitext(pv)[-1] == ".gz":
-        import gzip
-        pv = gzip.open(pv)
+        pv = gzip_open(pv)
     else:
         pv = open(pv)
     sts = Chem.ForwardSDMolSupplier(pv)
@@ -160,8 +164,7 @@ def count_poses(pv):
         Number of poses in the file.
     """
     if os.path.splitext(pv)[-1] == ".gz":
-        import gzip
-        pv = gzip.open(pv)
+        pv = gzip_open(pv)
     else:
         pv = open(pv)
     num_poses = [1 for i in Chem.ForwardSDMolSupplier(pv)]